@@ -1,10 +1,29 @@
 import asyncio
 import os
-from design_team.app import call_agent_async, session_service, APP_NAME, USER_ID, SESSION_ID, init_database
-from design_team.agents import root_agent
-from google.adk.runners import Runner
+import sys
+# The app's modules import each other by top-level name (as `chainlit run app.py` expects), so put this
+# directory on the path before importing them; `python -m design_team` would otherwise fail to resolve them
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from app import runner, session_service, APP_NAME, init_database
+from gemini_client import close_shared_client
+from agent_cache import agent_cache
+from google.genai import types
 from dotenv import load_dotenv
-import chainlit as cl
+
+# Define constants for identifying the interaction context
+USER_ID = "user_1"
+SESSION_ID = "session_001" # Using a fixed ID for simplicity
+
+async def call_agent_async(query: str, user_id: str, session_id: str) -> str:
+    """Sends a query to the shared runner and returns the final response text."""
+    content = types.Content(role='user', parts=[types.Part(text=query)])
+    final_response = "Agent did not produce a final response."
+
+    async for event in runner.run_async(user_id=user_id, session_id=session_id, new_message=content):
+        if event.is_final_response() and event.content and event.content.parts:
+            final_response = "".join(part.text for part in event.content.parts if part.text)
+
+    return final_response
 
 async def main():
     """
@@ -32,12 +51,21 @@ async def main():
 
     print(f"Runner created for agent '{runner.agent.name}'.")
 
-    user_input = input(">>> User Input: ")
-    response = await call_agent_async(user_input,
-                                       user_id=USER_ID,
-                                       session_id=SESSION_ID)
-    print(f"<<< Agent Response: {response}")
+    try:
+        user_input = input(">>> User Input: ")
+        response = await call_agent_async(user_input,
+                                           user_id=USER_ID,
+                                           session_id=SESSION_ID)
+        print(f"<<< Agent Response: {response}")
+    finally:
+        # The cache's aiosqlite worker thread is non-daemon and would keep the process alive
+        await close_shared_client()
+        await agent_cache.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if sys.platform != "win32":
+        import uvloop
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
@@ -0,0 +1,157 @@
+"""
+Response cache for the game design team's LLM agents.
+Agents wrapped in CachedLlmAgent skip the model call when the exact same request (model, system instruction,
+conversation contents and generation config) was answered recently, and reuse that answer instead.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+from typing import AsyncGenerator, Optional
+
+import aiosqlite
+from google.adk.agents import LlmAgent
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event
+from google.adk.models import LlmRequest, LlmResponse
+from google.genai import types
+from pydantic import PrivateAttr
+from config import DB_URL, config, sqlite_path
+
+class AgentResponseCache():
+    """Stores final model responses in the `agent_cache` table, keyed by a hash of the model request."""
+
+    def __init__(self, database_url: str, ttl_seconds: int):
+        self.database_url = sqlite_path(database_url)
+        self.ttl_seconds = ttl_seconds
+        self._table_ready = False
+        # Single long-lived connection, opened lazily on first use
+        self._db: Optional[aiosqlite.Connection] = None
+        self._db_lock = asyncio.Lock()
+
+    async def _get_db(self) -> aiosqlite.Connection:
+        async with self._db_lock:
+            if self._db is None:
+                self._db = await aiosqlite.connect(self.database_url, uri=True)
+            if not self._table_ready:
+                await self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS agent_cache (key TEXT PRIMARY KEY, output TEXT, ts INTEGER)"
+                )
+                await self._db.execute("CREATE INDEX IF NOT EXISTS idx_agent_cache_ts ON agent_cache(ts)")
+                await self._db.commit()
+                self._table_ready = True
+            return self._db
+
+    async def _execute(self, query: str, params: tuple):
+        db = await self._get_db()
+        try:
+            return await db.execute(query, params)
+        except sqlite3.OperationalError as e:
+            # The table can be dropped underneath us (e.g. `clear_database(fast=True)`), so recreate it once
+            if "no such table" not in str(e):
+                raise
+            self._table_ready = False
+            db = await self._get_db()
+            return await db.execute(query, params)
+
+    async def get(self, key: str) -> Optional[str]:
+        cursor = await self._execute(
+            "SELECT output FROM agent_cache WHERE key = ? AND ts >= ?",
+            (key, int(time.time()) - self.ttl_seconds),
+        )
+        async with cursor:
+            row = await cursor.fetchone()
+            return row[0] if row else None
+
+    async def set(self, key: str, output: str):
+        now = int(time.time())
+        await self._execute(
+            "INSERT OR REPLACE INTO agent_cache (key, output, ts) VALUES (?, ?, ?)",
+            (key, output, now),
+        )
+        # `get` already ignores expired rows; prune them here so the table doesn't grow without bound
+        await self._execute("DELETE FROM agent_cache WHERE ts < ?", (now - self.ttl_seconds,))
+        await self._db.commit()
+
+    async def close(self):
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+agent_cache = AgentResponseCache(DB_URL, config.agent_cache_ttl_seconds)
+
+def request_cache_key(llm_request: LlmRequest) -> str:
+    """Hashes everything the model sees: model name, generation config (incl. system instruction) and contents."""
+    generation_config = llm_request.config.model_dump(
+        mode="json", exclude_none=True, exclude={"http_options", "labels", "response_schema"}
+    ) if llm_request.config else {}
+    # Structured-output agents pass a pydantic class here, which only serializes by name
+    response_schema = getattr(llm_request.config, "response_schema", None)
+    payload = json.dumps(
+        {
+            "model": llm_request.model,
+            "config": generation_config,
+            "response_schema": getattr(response_schema, "__qualname__", None) or str(response_schema or ""),
+            "contents": [content.model_dump(mode="json", exclude_none=True) for content in llm_request.contents],
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class CachedLlmAgent(LlmAgent):
+    """LlmAgent that returns a cached response when the model request is identical to a recent one."""
+
+    # Request keys by invocation id, handed from the before- to the after-model callback
+    _pending_keys: dict[str, str] = PrivateAttr(default_factory=dict)
+
+    async def _cache_lookup(self, callback_context: CallbackContext, llm_request: LlmRequest) -> Optional[LlmResponse]:
+        key = request_cache_key(llm_request)
+        try:
+            cached_output = await agent_cache.get(key)
+        except Exception as e:
+            logging.warning(f"[{self.name}] Response cache lookup failed: {e}")
+            cached_output = None
+
+        if cached_output is not None:
+            logging.info(f"[{self.name}] Response cache hit, skipping model call.")
+            # ADK applies output_key / output_schema to this response like any model reply
+            return LlmResponse(content=types.Content(role="model", parts=[types.Part(text=cached_output)]))
+        self._pending_keys[callback_context.invocation_id] = key
+        return None
+
+    async def _cache_store(self, callback_context: CallbackContext, llm_response: LlmResponse) -> Optional[LlmResponse]:
+        # Streamed chunks are partial; only the aggregated final response is cached
+        if llm_response.partial:
+            return None
+        key = self._pending_keys.pop(callback_context.invocation_id, None)
+        if key is None or not llm_response.content or not llm_response.content.parts or llm_response.error_code:
+            return None
+        output = "".join(part.text for part in llm_response.content.parts if part.text and not part.thought)
+        if output:
+            try:
+                await agent_cache.set(key, output)
+            except Exception as e:
+                logging.warning(f"[{self.name}] Response cache write failed: {e}")
+        return None
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        try:
+            async for event in super()._run_async_impl(ctx):
+                yield event
+        finally:
+            # A failed model call never reaches the after-model callback, so drop its key here
+            self._pending_keys.pop(ctx.invocation_id, None)
+
+    @property
+    def canonical_before_model_callbacks(self):
+        # Last, so any request changes made by other callbacks are part of the key
+        return [*super().canonical_before_model_callbacks, self._cache_lookup]
+
+    @property
+    def canonical_after_model_callbacks(self):
+        return [*super().canonical_after_model_callbacks, self._cache_store]
@@ -1,20 +1,28 @@
+import asyncio
+import contextlib
 import logging
-from typing import AsyncGenerator, Literal
+from typing import AsyncGenerator, Literal, Optional
 from google.adk.agents import LlmAgent, BaseAgent, LoopAgent, SequentialAgent, ParallelAgent
 from google.adk.agents.invocation_context import InvocationContext
+from google.adk.agents.callback_context import CallbackContext
 from google.genai import types
 from google.adk.sessions import InMemorySessionService
 from google.adk.runners import Runner
 from google.adk.events import Event
 from google.adk.planners import BuiltInPlanner, PlanReActPlanner
 from google.adk.tools.agent_tool import AgentTool
-from google.adk.events import Event, EventActions
 from pydantic import BaseModel, Field
 from google.genai import types
 from config import config
 from team_agreement import team_agreement
+from agent_cache import CachedLlmAgent
+from gemini_client import shared_gemini
 
 # --- Constants ---
+# `temp:` state is shared within the invocation but never written to the session DB, so the loop's
+# per-iteration evaluations don't grow the persisted state on every turn. Requires google-adk 1.27+, where
+# temp: keys are visible to later agents in the same invocation.
+GAMEPLAY_EVALUATION_KEY = "temp:gameplay_evaluation"
 
 # --- Structured Output Models ---
 class Feedback(BaseModel):
@@ -31,10 +39,26 @@ class Feedback(BaseModel):
         description="A list of specific, targeted changes needed to fix gameplay issues. This should be null or empty if the grade is 'pass'.",
     )
 
+# Quality bar shared by the gameplay evaluator and refiner, kept identical so both prompts stay in sync
+GAMEPLAY_CRITERIA = """    - Core design principles integration: the gameplay must contribute to the game being clickable, social, replayable, and fun
+    - The core gameplay loop must be clear, engaging, and targeted
+    - The gameplay must be aligned with the core fantasy
+    - The gameplay must fit the target audience
+    - The gameplay must leverage successful tactics"""
+
+# --- Shared Prompt Prefix ---
+# Most-stable content first and byte-identical across the downstream agents, so Gemini's implicit prefix cache can hit.
+DESIGN_CONTEXT = f"""
+{ team_agreement }
+    ### INPUT DATA:
+    *   Game Overview: `{{game_overview}}`
+    *   Gameplay Plan: `{{gameplay_plan}}`
+"""
+
 # --- Agents ---
-lead_game_designer = LlmAgent(
+lead_game_designer = CachedLlmAgent(
 	name="LeadGameDesigner",
-	model=config.designer_model,
+	model=shared_gemini(config.designer_model),
 	description="Generates or refines the existing game design plan.",
 	instruction=f"""
 	You are a game design expert. Your job is to create a game design overview.
@@ -59,14 +83,14 @@ lead_game_designer = LlmAgent(
 	planner=BuiltInPlanner(
         thinking_config=types.ThinkingConfig(
             include_thoughts=False, # irrelevant to the team?
-            thinking_budget=1024,
+            thinking_budget=config.thinking_budget_creative,
         )
     ),
 )
 
-gameplay_designer = LlmAgent(
+gameplay_designer = CachedLlmAgent(
 	name="GameplayDesigner",
-	model=config.designer_model,
+	model=shared_gemini(config.designer_model),
 	description="Develops core mechanics, systems, and rules that empower the player's agency. Generates thorough plans and foresees contradictions.",
 	instruction=f"""
     You are a highly capable and dilligent gameplay designer and psychologist.
@@ -89,14 +113,26 @@ gameplay_designer = LlmAgent(
 	planner=BuiltInPlanner(
         thinking_config=types.ThinkingConfig(
             include_thoughts=True, # irrelevant to the team?
-            thinking_budget=1024,
+            thinking_budget=config.thinking_budget_creative,
         )
     ),
 )
 
+# --- Loop Control ---
+def escalate_on_pass(callback_context: CallbackContext) -> Optional[types.Content]:
+    """Escalates to stop the refinement loop once the gameplay evaluation is graded 'pass'."""
+    evaluation_result = callback_context.state.get(GAMEPLAY_EVALUATION_KEY)
+    if evaluation_result and evaluation_result.get("grade") == "pass":
+        logging.info("[gameplay_refinement_loop] Gameplay evaluation passed. Escalating to stop loop.")
+        callback_context.actions.escalate = True
+        # ADK only emits the callback's event (carrying the escalation) when it has content or a state change.
+        return types.Content(role="model", parts=[types.Part(text="Gameplay evaluation passed.")])
+    logging.info("[gameplay_refinement_loop] Gameplay evaluation failed or not found. Loop will continue.")
+    return None
+
 gameplay_evaluator = LlmAgent(
 	name="GameplayDesignCritic",
-	model=config.worker_model,
+	model=shared_gemini(config.worker_model),
 	description="Evaluates and provides feedback on gameplay mechanics, expected player experience, and design coherence.",
 	instruction=f"""
 	You are a meticulous, creative, veteran gameplay designer. Your task is to evaluate the gameplay overview in the `gameplay_plan` state key.
@@ -106,11 +142,7 @@ gameplay_evaluator = LlmAgent(
 
     
 	**ENSURE:**
-    - Core design principles integration: the gameplay must contribute to the game being clickable, social, replayable, and fun
-    - The core gameplay loop must be clear, engaging, and targeted
-	- The gameplay must be aligned with the core fantasy
-	- The gameplay must fit the target audience
-	- The gameplay must leverage successful tactics
+{ GAMEPLAY_CRITERIA }
 
     Your response must be a single, raw JSON object validating against the 'Feedback' schema.
 	""",
@@ -118,48 +150,14 @@ gameplay_evaluator = LlmAgent(
     output_schema=Feedback,
     disallow_transfer_to_parent=True,
     disallow_transfer_to_peers=True,
-    output_key="gameplay_evaluation",
-	# planner=BuiltInPlanner(
-    #     thinking_config=types.ThinkingConfig(
-    #         include_thoughts=False,
-    #         thinking_budget=1024,
-    #     )
-    # ),
+    output_key=GAMEPLAY_EVALUATION_KEY,
+    after_agent_callback=escalate_on_pass,
 )
 
-# --- Custom Agent for Loop Control ---
-class EscalationChecker(BaseAgent):
-    """Checks gameplay evaluation and escalates to stop the loop if grade is 'pass'."""
-
-    def __init__(self, name: str):
-        super().__init__(name=name)
-
-    async def _run_async_impl(
-        self, ctx: InvocationContext
-    ) -> AsyncGenerator[Event, None]:
-        evaluation_result = ctx.session.state.get("gameplay_evaluation")
-        if evaluation_result and evaluation_result.get("grade") == "pass":
-            logging.info(
-                f"[{self.name}] Gameplay evaluation passed. Escalating to stop loop."
-            )
-            yield Event(author=self.name, actions=EventActions(escalate=True))
-        else:
-            logging.info(
-                f"[{self.name}] Gameplay evaluation failed or not found. Loop will continue."
-            )
-            # Yielding an event without content or actions just lets the flow continue.
-            yield Event(author=self.name)
-	
 gameplay_refiner = LlmAgent(
-    model=config.worker_model,
+    model=shared_gemini(config.worker_model),
     name="gameplay_refiner",
     description="Refines gameplay according to feedback.",
-    # planner=BuiltInPlanner(
-    #     thinking_config=types.ThinkingConfig(
-    #         include_thoughts=False,
-    #         thinking_budget=1024,
-    #     )
-    # ),
     instruction=f"""
     You are an expert gameplay designer executing a refinement pass.
     You have been activated because the previous gameplay evaluation was graded as 'fail'.
@@ -168,32 +166,89 @@ gameplay_refiner = LlmAgent(
 
 	
 	**REVISE TO ENSURE:**
-    - Core design principles integration: the gameplay must contribute to the game being clickable, social, replayable, and fun
-    - The core gameplay loop must be clear, engaging, and targeted
-	- The gameplay must be aligned with the core fantasy
-	- The gameplay must fit the target audience
-	- The gameplay must leverage successful tactics
-    
+{ GAMEPLAY_CRITERIA }
+
     1. Familiarize yourself with the `game_overview` to understand the direction.
-    2. Review 'gameplay_evaluation' state key to understand the feedback and required fixes.
+    2. Review the gameplay evaluation below to understand the feedback and required fixes.
     3. Make revisions to the 'gameplay_plan' based on EVERYTHING listed in 'follow_ups'.
     4. Your output MUST be the new, complete, and improved gameplay plan.
+
+    GAMEPLAY EVALUATION:
+    {{{GAMEPLAY_EVALUATION_KEY}?}}
     """,
     output_key="gameplay_plan",
 )
 
-art_director = LlmAgent(
+class SpeculativeLoopAgent(BaseAgent):
+    """Evaluate/refine loop that runs the next refinement concurrently with the current evaluation.
+
+    From the second iteration on, the refiner starts immediately from the previous evaluation's feedback
+    (already in state). Its events are held back and discarded if the evaluator escalates with a 'pass'.
+    """
+
+    evaluator: BaseAgent
+    refiner: BaseAgent
+    max_iterations: int
+
+    def __init__(self, name: str, evaluator: BaseAgent, refiner: BaseAgent, max_iterations: int):
+        super().__init__(
+            name=name,
+            evaluator=evaluator,
+            refiner=refiner,
+            max_iterations=max_iterations,
+            sub_agents=[evaluator, refiner],
+        )
+
+    @staticmethod
+    async def _collect(agent: BaseAgent, ctx: InvocationContext) -> list[Event]:
+        return [event async for event in agent.run_async(ctx)]
+
+    @staticmethod
+    async def _cancel(task: Optional[asyncio.Task]):
+        if task is None:
+            return
+        task.cancel()
+        # The discarded refinement may already have finished or failed (e.g. a 429); its outcome no longer matters
+        with contextlib.suppress(asyncio.CancelledError, Exception):
+            await task
+
+    async def _run_async_impl(
+        self, ctx: InvocationContext
+    ) -> AsyncGenerator[Event, None]:
+        for iteration in range(self.max_iterations):
+            # The first iteration has no feedback from this run yet, so it refines serially
+            speculative_refinement = asyncio.create_task(self._collect(self.refiner, ctx)) if iteration > 0 else None
+            passed = False
+            try:
+                async for event in self.evaluator.run_async(ctx):
+                    yield event
+                    if event.actions and event.actions.escalate:
+                        passed = True
+            except BaseException:
+                await self._cancel(speculative_refinement)
+                raise
+
+            if passed:
+                logging.info(f"[{self.name}] Gameplay evaluation passed on iteration {iteration + 1}.")
+                await self._cancel(speculative_refinement)
+                return
+
+            if speculative_refinement is None:
+                async for event in self.refiner.run_async(ctx):
+                    yield event
+            else:
+                for event in await speculative_refinement:
+                    yield event
+
+art_director = CachedLlmAgent(
 	name="NarrativeDesigner",
-	model=config.designer_model,
+	model=shared_gemini(config.designer_model),
 	description="Imbues the existing game with rich artistic and narrative vision.",
-	instruction=f"""
+	instruction=DESIGN_CONTEXT + """
 	You are a video game Art Director responsible for the visual and narrative aspects of the game. Your task is to ensure that the game's art style, character designs, and narrative elements are cohesive and enhance the overall player experience.
-    
-	{ team_agreement }
 
-    
     ### TASK:
-    1. Review the existing `{{game_overview}}` and `{{gameplay_plan}}`
+    1. Review the Game Overview and Gameplay Plan above
     2. Generate a vision for the game world covering at least the following aspects:
 		a. Narrative
 		b. Aesthetic Vision
@@ -204,25 +259,23 @@ art_director = LlmAgent(
     planner=BuiltInPlanner(
         thinking_config=types.ThinkingConfig(
             include_thoughts=False,
-            thinking_budget=1024,
+            thinking_budget=config.thinking_budget_light,
         )
     ),
 )
 
-marketing_director = LlmAgent(
+marketing_director = CachedLlmAgent(
 	name="MarketingDirector",
-	model=config.designer_model,
+	model=shared_gemini(config.designer_model),
 	description="Crafts the marketing strategy and messaging for the game.",
-	instruction=f"""
+	instruction=DESIGN_CONTEXT + """
 	You are a relentless video game Marketing Director.
     Your task is to create a comprehensive marketing strategy that aligns with the game's vision and target audience.
     Discover intelligent moments during gameplay to place monetization.
     Analyze the target audience and tailor advertising to their preferences.
 
-	{ team_agreement }
-    
     ### TASK:
-    1. Review the `{{game_overview}}`, `{{gameplay_plan}}`, and `{{art_narrative_plan}}`
+    1. Review the Game Overview and Gameplay Plan above
     2. Generate a business strategy for the game covering monetization and marketing. Tailor this to the Roblox platform.
 
     ### Final Output:
@@ -235,26 +288,21 @@ marketing_director = LlmAgent(
 	planner=BuiltInPlanner(
         thinking_config=types.ThinkingConfig(
             include_thoughts=False,
-            thinking_budget=1024,
+            thinking_budget=config.thinking_budget_light,
         )
     ),
 )
 
-producer = LlmAgent(
+producer = CachedLlmAgent(
 	name="Producer",
-	model=config.designer_model,
+	model=shared_gemini(config.designer_model),
 	description="Plans a timeline and task list given a game design document.",
-	instruction=f"""
-	You are a meticulously organized video game producer. Review the information and develop a game plan for tackling all of the required tasks.
+	instruction=DESIGN_CONTEXT + """
+    *   Art and Narrative Plan: `{art_narrative_plan}`
+    *   Marketing Strategy: `{marketing_strategy}`
 
-	{ team_agreement }
+	You are a meticulously organized video game producer. Review the information and develop a game plan for tackling all of the required tasks.
 
-    ### INPUT DATA:
-    *   Game Overview: `{{game_overview}}`
-    *   Gameplay Plan: `{{gameplay_plan}}`
-    *   Art and Narrative Plan: `{{art_narrative_plan}}`
-    *   Marketing Strategy: `{{marketing_strategy}}`
-    
     ### TASK:
     Your task is to use the provided information to generate a detailed project plan, including task list and timeline.
 
@@ -270,55 +318,91 @@ producer = LlmAgent(
 	planner=BuiltInPlanner(
         thinking_config=types.ThinkingConfig(
             include_thoughts=False,
-            thinking_budget=1024,
+            thinking_budget=config.thinking_budget_light,
         )
     ),
 )
 
-# Plan Synthesizer not very useful, best to just unify the sections with code at the end.. probably just have this agent call a tool
-plan_synthesizer = LlmAgent(
+# LLM fallback for the code-assembled GDD, used when `use_llm_synthesizer` is on
+plan_synthesizer = CachedLlmAgent(
 	name="PlanSynthesizer",
-	model=config.worker_model,
+	model=shared_gemini(config.worker_model),
 	description="Unifies all content into a coherent Game Design Document.",
-	instruction="""
-    Transform the provided information into a polished, professional, beautiful Game Design Document.
-	### INPUT DATA:
-    *   Game Overview: `{game_overview}`
-    *   Gameplay Plan: `{gameplay_plan}`
+	instruction=DESIGN_CONTEXT + """
     *   Art and Narrative Plan: `{art_narrative_plan}`
-	*   Marketing Strategy: `{marketing_strategy}`
+    *   Marketing Strategy: `{marketing_strategy}`
     *   Production Plan: `{production_plan}`
-    
+
+    Transform the provided information into a polished, professional, beautiful Game Design Document.
+
     ## Final Instructions:
     Generate a comprehensive Game Design Document that incorporates all the above elements. Return only this document.
 	""",
 	include_contents='default',
-	# planner=BuiltInPlanner(
-    #     thinking_config=types.ThinkingConfig(
-    #         include_thoughts=False,
-    #         thinking_budget=1024,
-    #     )
-    # ),
 )
 
+class PlanSynthesizerAgent(BaseAgent):
+    """Assembles the Game Design Document from the team's outputs without a model call."""
+
+    def __init__(self, name: str):
+        super().__init__(name=name, description="Unifies all content into a coherent Game Design Document.")
+
+    async def _run_async_impl(
+        self, ctx: InvocationContext
+    ) -> AsyncGenerator[Event, None]:
+        state = ctx.session.state
+        document = f"""# Game Design Document
+
+## Game Overview
+{state.get("game_overview", "")}
+
+## Gameplay Plan
+{state.get("gameplay_plan", "")}
+
+## Art and Narrative Plan
+{state.get("art_narrative_plan", "")}
+
+## Marketing Strategy
+{state.get("marketing_strategy", "")}
+
+## Production Plan
+{state.get("production_plan", "")}
+"""
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            content=types.Content(role="model", parts=[types.Part(text=document)]),
+        )
+
 # Idea: Use LoopAgent with human-in-the-loop tool for iteration and refinement
 project_pipeline = SequentialAgent(
 	name="ProjectPipeline",
 	sub_agents=[
         gameplay_designer,
-		LoopAgent(
+		SpeculativeLoopAgent(
+			name="gameplay_refinement_loop",
+			evaluator=gameplay_evaluator, # escalates via after_agent_callback on 'pass'
+			refiner=gameplay_refiner,
+			max_iterations=config.max_gameplay_design_iterations,
+		) if config.speculative_gameplay_refinement else LoopAgent(
 			name="gameplay_refinement_loop",
 			max_iterations=config.max_gameplay_design_iterations,
 			sub_agents=[
-				gameplay_evaluator,
-				EscalationChecker(name="escalation_checker"),
+				gameplay_evaluator, # escalates via after_agent_callback on 'pass'
 				gameplay_refiner,
 			],
 		),
-		art_director,
-		marketing_director,
+		# Art and marketing only depend on the overview and gameplay plan, so run them concurrently
+		ParallelAgent(
+			name="world_and_market",
+			sub_agents=[
+				art_director,
+				marketing_director,
+			],
+		),
         producer,
-		# plan_synthesizer
+		plan_synthesizer if config.use_llm_synthesizer else PlanSynthesizerAgent(name="PlanSynthesizer"),
 	]
 )
 
@@ -326,7 +410,7 @@ project_pipeline = SequentialAgent(
 
 interactive_planner_agent = LlmAgent(
     name="interactive_planner_agent",
-    model=config.worker_model,
+    model=shared_gemini(config.worker_model),
     description="The primary game design agent. Collaborates with the directing user and then executes the project design.",
     instruction=f"""
     You are a game design assistant. Your primary function is to convert ANY user request into a game design overview.
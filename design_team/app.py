@@ -1,9 +1,11 @@
 import os
 import asyncio
+from collections import deque
 from google.adk.agents import Agent
 # from google.adk.models.lite_llm import LiteLlm # For multi-model support
 from google.adk.sessions import InMemorySessionService, DatabaseSessionService
 from google.adk.runners import Runner
+from google.adk.agents.run_config import RunConfig, StreamingMode
 from google.genai import types # For creating message Content/Parts
 import logging
 from dotenv import load_dotenv
@@ -13,8 +15,11 @@ from chainlit.types import ThreadDict
 from googleadk_database_layer import GoogleADKDataLayer
 from typing import Optional
 from agents import root_agent
+from gemini_client import close_shared_client
+from agent_cache import agent_cache
 import sqlite3
-from config import APP_NAME
+from sqlalchemy.engine.url import make_url
+from config import APP_NAME, DB_URL, sqlite_path
 
 # __all__ = ["root_agent"]
 
@@ -22,61 +27,112 @@ from config import APP_NAME
 load_dotenv()
 os.environ["GOOGLE_GENAI_USE_VERTEXAI"] = "False"
 
+logger = logging.getLogger("design_team")
+logger.setLevel(logging.WARNING)
+
 # session_service = InMemorySessionService()
-db_url = os.environ["DB_URL"] or "sqlite:///design_team_sessions.db" # Using synchronous SQLite for session service
-session_service = DatabaseSessionService(db_url=db_url)
+make_url(DB_URL)  # Fail fast on a malformed DB_URL, once at startup
+session_service = DatabaseSessionService(db_url=DB_URL)
+
+def _probe_database():
+    # Test basic database connectivity (uri=True also accepts `file:...?mode=memory` dev databases)
+    conn = sqlite3.connect(sqlite_path(DB_URL), uri=True)
+    conn.execute("SELECT 1")  # Simple test query
+    # WAL persists in the database file, letting readers proceed during session writes
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.close()
 
 async def init_database():
-    """Initialize the database with required tables."""
+    """Initialize the database with required tables. Only run once at startup, never at import."""
     try:
         # The DatabaseSessionService handles table creation automatically
         # We just need to ensure the database file can be created
+        # Blocking sqlite3 I/O runs in a worker thread to keep the event loop free
+        await asyncio.to_thread(_probe_database)
         
-        # Test basic database connectivity
-        db_path = "design_team_sessions.db"
-        conn = sqlite3.connect(db_path)
-        conn.execute("SELECT 1")  # Simple test query
-        conn.close()
-        
-        print("Database connection successful!")
+        logger.debug("Database connection successful!")
         return True
     except Exception as e:
-        print(f"Database initialization error: {e}")
-        print("This is normal if the database doesn't exist yet - it will be created automatically.")
+        logger.warning("Database initialization error: %s", e)
+        logger.warning("This is normal if the database doesn't exist yet - it will be created automatically.")
         return True  # Continue anyway, as the service will create tables as needed
 
-# Run DB initialization at startup
-asyncio.run(init_database())
+# Run DB initialization when executed directly; chainlit already owns the event loop on import
+if __name__ == "__main__":
+    asyncio.run(init_database())
 
-# Define constants for identifying the interaction context
-# USER_ID = "user_1"
-# SESSION_ID = "session_001" # Using a fixed ID for simplicity
+@cl.on_app_startup
+async def on_app_startup():
+    await init_database()
+
+@cl.on_app_shutdown
+async def on_app_shutdown():
+    # The Gemini connection pool and the response cache are shared by every chat, so they are only closed with the app
+    await close_shared_client()
+    await agent_cache.close()
 
 runner = Runner(
     agent=root_agent, # The agent we want to run
     app_name=APP_NAME,   # Associates runs with our app
     session_service=session_service # Uses our session manager
 )
-print(f"Runner created for agent '{runner.agent.name}'.")
+logger.debug("Runner created for agent '%s'.", runner.agent.name)
+# Stream partial model output so the UI can render tokens as they arrive
+run_config = RunConfig(streaming_mode=StreamingMode.SSE)
 
 
 @cl.header_auth_callback
 async def header_auth_callback(headers: Headers) -> Optional[cl.User]:
   # Verify the signature of a token in the header (ex: jwt token)
   # or check that the value is matching a row from your database
-  print('logging in', Headers)
   return cl.User(identifier="default_user", metadata={"role": "DEV", "provider": "header"})
 #   if headers.get("test-header") == "test-value":
 #     return cl.User(identifier="admin", metadata={"role": "admin", "provider": "header"})
 #   else:
 #     return None
 
-data_layer = GoogleADKDataLayer(db_url)
+data_layer = GoogleADKDataLayer(DB_URL)
 @cl.data_layer
 def get_data_layer():
-    print("data layer")
     return data_layer
 
+STEP_FLUSH_INTERVAL = 0.05 # seconds to wait for more steps before flushing a batch
+STEP_FLUSH_BATCH_SIZE = 16 # flush early once this many steps are pending
+
+def to_chainlit_step(step, session_id) -> cl.Step:
+    return cl.Step(
+        name = step.get("name", "default_step"),
+        type = step.get("type", "run"),
+        id = step.get("id", None),
+        parent_id = step.get("parentId", None),
+        # elements = step.get("elements", []),
+        metadata = step.get("metadata", {}),
+        # tags: Optional[List[str]] = None,
+        # language: Optional[str] = None,
+        default_open = False,
+        show_input = step.get("showInput", False),
+        thread_id = step.get("threadId", session_id),
+    )
+
+async def send_steps(queue: asyncio.Queue, session_id):
+    """Drain converted steps from the queue and send them to the UI in concurrent batches."""
+    pending = deque()
+    finished = False
+    while not finished:
+        timed_out = False
+        try:
+            step = await asyncio.wait_for(queue.get(), timeout=STEP_FLUSH_INTERVAL)
+            if step is None:
+                finished = True
+            else:
+                pending.append(step)
+        except asyncio.TimeoutError:
+            timed_out = True
+        if pending and (finished or timed_out or len(pending) >= STEP_FLUSH_BATCH_SIZE):
+            batch = [to_chainlit_step(pending.popleft(), session_id) for _ in range(len(pending))]
+            await asyncio.gather(*(step.send() for step in batch))
+
 @cl.step(type="tool")
 async def tool():
     # Simulate a running task
@@ -87,7 +143,7 @@ async def tool():
 # New chat started:
 @cl.on_chat_start
 async def on_chat_start():
-    print("A new chat session has started!")
+    logger.debug("A new chat session has started!")
     
     user = cl.user_session.get("user")
     user_id = user and user.identifier or "default_user"
@@ -99,86 +155,110 @@ async def on_chat_start():
             user_id=user_id,
             session_id=session_id
         )
-        print(f"Session created: App='{APP_NAME}', User='{user_id}', Session='{session_id}'")
+        logger.debug("Session created: App='%s', User='%s', Session='%s'", APP_NAME, user_id, session_id)
         cl.user_session.set("session_id", session_id)
         cl.user_session.set("user_id", user_id)
+        cl.user_session.set("adk_session", session)
         await cl.Message(content="Your personal **Game Design Team**, here to help! \n\nTo get started, *describe your game idea.*").send()
     except Exception as e:
-        print(f"Error creating session: {e}")
-        print("Attempting to use existing session...")
+        logger.error("Error creating session: %s", e)
+        logger.warning("Attempting to use existing session...")
 
 # New message received from user:
 @cl.on_message
 async def on_message(msg: cl.Message):
-    print("The user sent: ", msg.content)
+    logger.debug("The user sent: %s", msg.content)
     session_id = cl.user_session.get("session_id")
     user_id = cl.user_session.get("user_id") #msg.thread_id?
     if not session_id or not user_id:
-        print("No session or user ID found. Cannot process message.")
+        logger.warning("No session or user ID found. Cannot process message.")
         await cl.Message(content="Error: No active session or user ID found.").send()
         return
 
     content = types.Content(role='user', parts=[types.Part(text=msg.content)])
+    # The runner appends events to its own copy of the session, so the cached one is now stale
+    cl.user_session.set("adk_session", None)
+
+    # Steps are handed off to a background sender so the UI round-trips don't block the agent event stream.
+    step_queue = asyncio.Queue()
+    sender = asyncio.create_task(send_steps(step_queue, session_id))
 
     # Key Concept: run_async executes the agent logic and yields Events.
     # We iterate through events to find the final answer.
-    async for event in runner.run_async(user_id=user_id, session_id=session_id, new_message=content):
-        # You can uncomment the line below to see *all* events during execution
-        # print(f"  [Event] Author: {event.author}, Type: {type(event).__name__}, Final: {event.is_final_response()}, Content: {event.content}")
-        steps, elements = data_layer._convert_event_to_chainlit(session_id, event)
-        for step in steps:
-            await cl.Step(
-                name = step.get("name", "default_step"),
-                type = step.get("type", "run"),
-                id = step.get("id", None),
-                parent_id = step.get("parentId", None),
-                # elements = step.get("elements", []),
-                metadata = step.get("metadata", {}),
-                # tags: Optional[List[str]] = None,
-                # language: Optional[str] = None,
-                default_open = False,
-                show_input = step.get("showInput", False),
-                thread_id = step.get("threadId", session_id),
-            ).send()
-
-        # Key Concept: is_final_response() marks the concluding message for the turn.
-        # if event.actions and event.actions.escalate: # Handle potential errors/escalations
-        #     await response.stream_token("\n\n[Escalation: " + str(event) + "]")
+    # One streamed message per agent, as parallel agents interleave their partial events
+    streamed_messages: dict[str, cl.Message] = {}
+    try:
+        async for event in runner.run_async(user_id=user_id, session_id=session_id, new_message=content, run_config=run_config):
+            # Set the "design_team" logger to DEBUG to see *all* events during execution
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("  [Event] Author: %s, Type: %s, Final: %s, Content: %s", event.author, type(event).__name__, event.is_final_response(), event.content)
+            if event.partial:
+                parts = event.content.parts if event.content and event.content.parts else []
+                delta = "".join(part.text for part in parts if part.text and not part.thought)
+                if delta:
+                    streamed_msg = streamed_messages.get(event.author)
+                    if streamed_msg is None:
+                        # Partial and final events share event.id, so the final event's child steps find this parent
+                        streamed_msg = cl.Message(id=event.id, content="", author=event.author)
+                        streamed_messages[event.author] = streamed_msg
+                        await streamed_msg.send()
+                    await streamed_msg.stream_token(delta)
+                continue
+
+            steps = data_layer._convert_event_to_chainlit(session_id, event)
+            streamed_msg = streamed_messages.pop(event.author, None)
+            if streamed_msg is not None:
+                await streamed_msg.update()
+                # The streamed message already shows this event's text
+                steps = [step for step in steps if not (step["id"] == event.id and step["type"] == "assistant_message")]
+            for step in steps:
+                step_queue.put_nowait(step)
+
+            # Key Concept: is_final_response() marks the concluding message for the turn.
+            # if event.actions and event.actions.escalate: # Handle potential errors/escalations
+            #     await response.stream_token("\n\n[Escalation: " + str(event) + "]")
+    finally:
+        for streamed_msg in streamed_messages.values():
+            await streamed_msg.update()
+        step_queue.put_nowait(None)
+        await sender
 
 # Task cancelled (stop button pressed):
 @cl.on_stop
 def on_stop():
-    print("The user wants to stop the task!")
+    logger.debug("The user wants to stop the task!")
 
 # Chat ended (disconnect/switched chat session)
 @cl.on_chat_end
 async def on_chat_end():
-    print("The user disconnected!")
+    logger.debug("The user disconnected!")
     # If the session is empty, do not persist/delete it:
     session_id = cl.user_session.get("session_id")
     user_id = cl.user_session.get("user_id") #msg.thread_id?
     if not session_id or not user_id:
-        print("No session or user ID found. Cannot stop.")
+        logger.warning("No session or user ID found. Cannot stop.")
         return
     try:
-        # This will persist the session state to the database
-        session = await session_service.get_session(app_name=APP_NAME, user_id=user_id, session_id=session_id)
+        # Reuse the session from start/resume when no message was sent since, avoiding a DB read
+        session = cl.user_session.get("adk_session")
+        if session is None:
+            session = await session_service.get_session(app_name=APP_NAME, user_id=user_id, session_id=session_id)
         if session:
-            print(f"Session ended: App='{APP_NAME}', User='{user_id}', Session='{str(session)}'")
+            logger.debug("Session ended: App='%s', User='%s', Session='%s'", APP_NAME, user_id, session_id)
             if not session.events:
-                print("Session is empty, deleting.")
+                logger.debug("Session is empty, deleting.")
                 await session_service.delete_session(app_name=APP_NAME, user_id=user_id, session_id=session_id)
         else:
-            print(f"No active session found for App='{APP_NAME}', User='{user_id}', Session='{session_id}'")
+            logger.debug("No active session found for App='%s', User='%s', Session='%s'", APP_NAME, user_id, session_id)
     except Exception as e:
-        print(f"Error retrieving session: {e}")
+        logger.error("Error retrieving session: %s", e)
         return
 
 
 # Resumed (only works with chainlit authentication & data persistence)
 @cl.on_chat_resume
 async def on_chat_resume(thread: ThreadDict):
-    print("The user resumed a previous chat session!", thread.get("id"))
+    logger.debug("The user resumed a previous chat session! %s", thread.get("id"))
     user = cl.user_session.get("user")
     user_id = user and user.identifier or "default_user"
     session_id = thread.get("id") # Use the same for simplicity
@@ -189,9 +269,10 @@ async def on_chat_resume(thread: ThreadDict):
             user_id=user_id,
             session_id=session_id
         )
-        print(f"Session retrieved: App='{APP_NAME}', User='{user_id}', Session='{session_id}'")
+        logger.debug("Session retrieved: App='%s', User='%s', Session='%s'", APP_NAME, user_id, session_id)
         cl.user_session.set("session_id", session_id)
         cl.user_session.set("user_id", user_id)
+        cl.user_session.set("adk_session", session)
     except Exception as e:
-        print(f"Error resuming session: {e}")
+        logger.error("Error resuming session: %s", e)
 
@@ -1,7 +1,25 @@
+import os
+from dotenv import load_dotenv
+
+# Loaded here so DB_URL (and the API key) are set before any module reads them at import time
+load_dotenv()
+
 class Configuration():
 	worker_model: str = "gemini-2.0-flash"
 	designer_model: str = "gemini-2.5-pro"
 	max_gameplay_design_iterations: int = 5
+	# Refine against the previous evaluation while the current one runs. Faster, but each refinement applies
+	# feedback one evaluation late, so the last evaluation's follow-ups are never applied
+	speculative_gameplay_refinement: bool = False
+	thinking_budget_creative: int = 1024 # lead & gameplay designers
+	thinking_budget_light: int = 256 # art, marketing, production
+	use_llm_synthesizer: bool = False # False: assemble the GDD in code instead of an LLM call
+	agent_cache_ttl_seconds: int = 7 * 24 * 60 * 60 # cached agent responses older than this are ignored
 
 config = Configuration()
-APP_NAME = "game_design_team_app"
\ No newline at end of file
+APP_NAME = "game_design_team_app"
+DB_URL = os.environ.get("DB_URL") or "sqlite+aiosqlite:///design_team_sessions.db" # Async driver so session I/O doesn't block the event loop
+
+def sqlite_path(db_url: str) -> str:
+	"""Strips the SQLAlchemy dialect prefix (e.g. `sqlite+aiosqlite:///`) from a sqlite URL, leaving the file path."""
+	return db_url.split(":///", 1)[-1]
@@ -6,12 +6,53 @@ This module provides tools to inspect and manage the SQLite database.
 import asyncio
 import os
 import sqlite3
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from typing import List, Dict, Any
 
 # Database file path (same as in main.py)
 DB_FILE = "design_team_sessions.db"
 
+# Connection tuning: WAL + NORMAL sync avoids an fsync per commit, the rest keeps work in memory
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL;"
+    "PRAGMA synchronous=NORMAL;"
+    "PRAGMA temp_store=MEMORY;"
+    "PRAGMA cache_size=-65536;"
+    "PRAGMA mmap_size=268435456;"
+    "PRAGMA busy_timeout=5000;"
+)
+
+# Columns of the `sessions` table created by ADK's DatabaseSessionService
+SESSION_COLUMNS = ("app_name", "user_id", "id", "state", "create_time", "update_time")
+
+def _quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+def _quote_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+def _list_tables(cursor: sqlite3.Cursor) -> List[str]:
+    """Names of the user tables, skipping SQLite's internal `sqlite_*` tables."""
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite\\_%' ESCAPE '\\'")
+    return [row[0] for row in cursor]
+
+def _connect(db_path: Path) -> sqlite3.Connection:
+    """Open a connection to the database with the performance PRAGMAs applied."""
+    conn = sqlite3.connect(str(db_path))
+    conn.executescript(SQLITE_PRAGMAS)
+    return conn
+
+# Indexes for the filters used by the admin helpers and the chainlit data layer (idempotent)
+INDEX_MIGRATION = """
+BEGIN;
+CREATE INDEX IF NOT EXISTS idx_events_session_id ON events(session_id);
+CREATE INDEX IF NOT EXISTS idx_sessions_user_id_ctime ON sessions(user_id, create_time DESC);
+CREATE INDEX IF NOT EXISTS idx_sessions_ctime ON sessions(create_time);
+COMMIT;
+ANALYZE;
+"""
+
 def get_db_path() -> Path:
     """Get the absolute path to the database file."""
     return Path.cwd() / DB_FILE
@@ -32,18 +73,22 @@ def get_db_info() -> Dict[str, Any]:
         size_mb = size_bytes / (1024 * 1024)
         
         # Connect and get table info
-        with sqlite3.connect(str(db_path)) as conn:
+        with _connect(db_path) as conn:
+            conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
             # Get list of tables
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-            tables = [row[0] for row in cursor.fetchall()]
+            tables = _list_tables(cursor)
             
-            # Get row counts for each table
+            # Get row counts for every table in a single statement
             table_counts = {}
-            for table in tables:
-                cursor.execute(f"SELECT COUNT(*) FROM {table}")
-                table_counts[table] = cursor.fetchone()[0]
+            if tables:
+                cursor.execute(" UNION ALL ".join(
+                    f"SELECT {_quote_literal(table)} AS name, COUNT(*) AS n FROM {_quote_identifier(table)}"
+                    for table in tables
+                ))
+                for name, count in cursor:
+                    table_counts[name] = count
         
         return {
             "exists": True,
@@ -67,54 +112,78 @@ def list_sessions() -> List[Dict[str, Any]]:
         return []
     
     try:
-        with sqlite3.connect(str(db_path)) as conn:
+        with _connect(db_path) as conn:
+            conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
-            # Try to find the sessions table (name may vary)
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-            tables = [row[0] for row in cursor.fetchall()]
-            
-            sessions_table = None
-            for table in tables:
-                if 'session' in table.lower():
-                    sessions_table = table
-                    break
-            
-            if not sessions_table:
-                return []
-            
-            # Get all sessions
-            cursor.execute(f"SELECT * FROM {sessions_table}")
-            columns = [description[0] for description in cursor.description]
-            rows = cursor.fetchall()
-            
-            return [dict(zip(columns, row)) for row in rows]
+            # Get all sessions, selecting the known ADK columns directly
+            cursor.execute(f"SELECT {', '.join(SESSION_COLUMNS)} FROM sessions")
+            return [dict(row) for row in cursor]
     
+    except sqlite3.OperationalError as e:
+        if "no such table" in str(e):
+            return []  # The session service hasn't created its tables yet
+        print(f"Error listing sessions: {e}")
+        return []
     except Exception as e:
         print(f"Error listing sessions: {e}")
         return []
 
-def clear_database():
-    """Clear all data from the database (but keep the structure)."""
+def ensure_indexes():
+    """Create the lookup indexes on the session tables if they don't exist yet."""
     db_path = get_db_path()
     if not db_path.exists():
         print("Database file does not exist.")
         return
     
     try:
-        with sqlite3.connect(str(db_path)) as conn:
+        with _connect(db_path) as conn:
+            try:
+                conn.executescript(INDEX_MIGRATION)
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+            print("Indexes are up to date.")
+    
+    except Exception as e:
+        print(f"Error creating indexes: {e}")
+
+def clear_database(fast: bool = False):
+    """Clear all data from the database and reclaim the freed space.
+    
+    By default the table structure is kept. With `fast=True` the tables are dropped instead,
+    and ADK's DatabaseSessionService recreates its schema the next time the app starts.
+    """
+    db_path = get_db_path()
+    if not db_path.exists():
+        print("Database file does not exist.")
+        return
+    
+    try:
+        with _connect(db_path) as conn:
             cursor = conn.cursor()
             
             # Get all tables
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-            tables = [row[0] for row in cursor.fetchall()]
+            tables = _list_tables(cursor)
             
-            # Clear each table
-            for table in tables:
-                cursor.execute(f"DELETE FROM {table}")
+            if fast:
+                # Dropping pages wholesale is O(1) per table regardless of row count
+                conn.executescript(
+                    "BEGIN;" + "".join(f"DROP TABLE IF EXISTS {_quote_identifier(table)};" for table in tables) + "COMMIT;"
+                )
+            else:
+                # WHERE-less DELETEs hit SQLite's truncate optimization only without secure_delete
+                conn.execute("PRAGMA secure_delete=OFF")
+                # Clear every table in one script and transaction
+                conn.executescript(
+                    "BEGIN;" + "".join(f"DELETE FROM {_quote_identifier(table)};" for table in tables) + "COMMIT;"
+                )
             
-            conn.commit()
-            print(f"Cleared data from {len(tables)} tables.")
+            # Return the freed pages to the OS (must run outside a transaction); in WAL mode the
+            # rebuilt file only lands on disk after a checkpoint
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            print(f"{'Dropped' if fast else 'Cleared data from'} {len(tables)} tables.")
     
     except Exception as e:
         print(f"Error clearing database: {e}")
@@ -136,7 +205,7 @@ def delete_session(session_id: str):
         return
     
     try:
-        with sqlite3.connect(str(db_path)) as conn:
+        with _connect(db_path) as conn:
             cursor = conn.cursor()
             
             # Delete in order to maintain referential integrity
@@ -164,18 +233,18 @@ def delete_user_data(user_id: str):
         return
     
     try:
-        with sqlite3.connect(str(db_path)) as conn:
+        with _connect(db_path) as conn:
             cursor = conn.cursor()
             
-            # Get session IDs for this user first
-            cursor.execute("SELECT id FROM sessions WHERE user_id = ?", (user_id,))
-            session_ids = [row[0] for row in cursor.fetchall()]
+            # One transaction so WAL only syncs once for the whole cleanup
+            conn.execute("BEGIN IMMEDIATE")
             
             # Delete events for all user sessions
-            events_deleted = 0
-            for session_id in session_ids:
-                cursor.execute("DELETE FROM events WHERE session_id = ?", (session_id,))
-                events_deleted += cursor.rowcount
+            cursor.execute(
+                "DELETE FROM events WHERE session_id IN (SELECT id FROM sessions WHERE user_id = ?)",
+                (user_id,)
+            )
+            events_deleted = cursor.rowcount
             
             # Delete user states
             cursor.execute("DELETE FROM user_states WHERE user_id = ?", (user_id,))
@@ -200,33 +269,35 @@ def delete_old_sessions(days: int = 7):
         return
     
     try:
-        with sqlite3.connect(str(db_path)) as conn:
+        with _connect(db_path) as conn:
             cursor = conn.cursor()
             
-            # Get old session IDs first
-            cursor.execute(
-                "SELECT id FROM sessions WHERE create_time < datetime('now', '-{} days')".format(days)
-            )
-            old_session_ids = [row[0] for row in cursor.fetchall()]
+            # Computed once and bound, in the same UTC "YYYY-MM-DD HH:MM:SS" form as SQLite's datetime('now')
+            cutoff = (datetime.now(timezone.utc) - timedelta(days=int(days))).strftime("%Y-%m-%d %H:%M:%S")
             
-            if not old_session_ids:
-                print(f"No sessions older than {days} days found.")
-                return
+            # One transaction so WAL only syncs once for the whole cleanup
+            conn.execute("BEGIN IMMEDIATE")
             
             # Delete events for old sessions
-            events_deleted = 0
-            for session_id in old_session_ids:
-                cursor.execute("DELETE FROM events WHERE session_id = ?", (session_id,))
-                events_deleted += cursor.rowcount
+            cursor.execute(
+                "DELETE FROM events WHERE session_id IN (SELECT id FROM sessions WHERE create_time < ?)",
+                (cutoff,)
+            )
+            events_deleted = cursor.rowcount
             
             # Delete old sessions
             cursor.execute(
-                "DELETE FROM sessions WHERE create_time < datetime('now', '-{} days')".format(days)
+                "DELETE FROM sessions WHERE create_time < ?",
+                (cutoff,)
             )
             sessions_deleted = cursor.rowcount
             
             conn.commit()
             
+            if not sessions_deleted:
+                print(f"No sessions older than {days} days found.")
+                return
+            
             print(f"Deleted {sessions_deleted} sessions and {events_deleted} events older than {days} days.")
     
     except Exception as e:
@@ -238,6 +309,7 @@ if __name__ == "__main__":
     
     info = get_db_info()
     if info["exists"]:
+        ensure_indexes()
         print(f"Database exists: {info['path']}")
         print(f"Size: {info.get('size_mb', 0)} MB")
         
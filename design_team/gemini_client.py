@@ -0,0 +1,27 @@
+"""
+Shared Gemini transport for the game design team's agents.
+ADK builds a fresh google-genai Client (and HTTP connection pool) per model instance, so every agent call
+would pay its own TCP/TLS setup. These helpers route all agents through one long-lived httpx client instead.
+"""
+
+from functools import cache
+
+import httpx
+from google.adk.models import Gemini
+from google.genai import Client, types
+import config # noqa: F401 -- loads `.env` before the client reads the API key
+
+transport = httpx.AsyncHTTPTransport(http2=True, retries=2)
+shared_client = httpx.AsyncClient(transport=transport, limits=httpx.Limits(max_keepalive_connections=32))
+
+@cache
+def genai_client() -> Client:
+    """One genai client for every agent; the app always talks to the Gemini API, not Vertex AI."""
+    return Client(vertexai=False, http_options=types.HttpOptions(httpx_async_client=shared_client))
+
+def shared_gemini(model: str) -> Gemini:
+    # `client` is a Gemini field since google-adk 2.8; ADK still adds its tracking headers and retry options
+    return Gemini(model=model, client=genai_client())
+
+async def close_shared_client():
+    await shared_client.aclose()
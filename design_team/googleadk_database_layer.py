@@ -1,12 +1,13 @@
 import asyncio
 import atexit
-import json
 import signal
 import uuid
+from collections import OrderedDict
 from datetime import datetime
 from typing import TYPE_CHECKING, Any, Dict, List, Optional, Union
 
 import aiosqlite
+import orjson
 import aiofiles
 from chainlit.data.base import BaseDataLayer
 from chainlit.data.storage_clients.base import BaseStorageClient
@@ -25,9 +26,9 @@ from chainlit.types import (
 )
 from chainlit.user import PersistedUser, User
 from google.adk.events import Event
-import os
 from google.adk.sessions import InMemorySessionService, DatabaseSessionService, Session
-from config import APP_NAME
+from config import APP_NAME, DB_URL, sqlite_path
+from database_manager import INDEX_MIGRATION
 from google.genai.types import Content
 
 
@@ -38,9 +39,55 @@ if TYPE_CHECKING:
     from chainlit.step import StepDict
 
 ISO_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
-
-db_url = os.environ["DB_URL"] or "sqlite:///design_team_sessions.db" # Using synchronous SQLite for session service
-session_service = DatabaseSessionService(db_url=db_url)
+SQLITE_PRAGMAS = "PRAGMA journal_mode=WAL;PRAGMA synchronous=NORMAL;PRAGMA busy_timeout=5000;"
+SQLITE_CACHED_STATEMENTS = 256 # sqlite3 caches compiled statements by SQL text, per connection
+EVENT_CACHE_SIZE = 1024 # converted events kept for re-use between live streaming and thread loads
+THREAD_STEPS_CACHE_SIZE = 64 # converted threads kept for re-opening from the sidebar
+
+# Fixed query texts, so the reused connection's statement cache skips re-parsing them
+_Q_GET_USER = """
+SELECT user_id, MIN(create_time) as created_at
+FROM sessions
+WHERE user_id = ?
+GROUP BY user_id
+"""
+
+_Q_GET_THREAD_AUTHOR = """
+SELECT user_id
+FROM sessions
+WHERE id = ?
+"""
+
+_Q_GET_THREAD = """
+SELECT
+    id,
+    create_time as "createdAt",
+    id as name,
+    user_id,
+    state as metadata,
+    (SELECT MAX(timestamp) FROM events WHERE session_id = sessions.id) as "lastEventAt"
+FROM sessions
+WHERE id = ?
+"""
+
+# LIKE is already case-insensitive for ASCII in SQLite (ILIKE is not SQLite syntax)
+_Q_LIST_THREADS = """
+SELECT
+    s.id,
+    s.create_time as "createdAt",
+    s.id as name,
+    s.user_id as "userId",
+    s.user_id as user_identifier,
+    s.state as metadata
+FROM sessions s
+WHERE (? IS NULL OR s.id LIKE ?)
+AND (? IS NULL OR s.user_id = ?)
+AND (? IS NULL OR s.create_time < (SELECT create_time FROM sessions WHERE id = ?))
+ORDER BY s.create_time DESC
+LIMIT ?
+"""
+
+session_service = DatabaseSessionService(db_url=DB_URL)
 
 class GoogleADKDataLayer(BaseDataLayer):
     def __init__(
@@ -49,9 +96,17 @@ class GoogleADKDataLayer(BaseDataLayer):
         storage_client: Optional[BaseStorageClient] = None,
         show_logger: bool = False,
     ):
-        self.database_url = database_url.replace("sqlite:///", "")
+        self.database_url = sqlite_path(database_url)
         self.storage_client = storage_client
         self.show_logger = show_logger
+        # ADK events are not hashable, so cache conversions explicitly by event id
+        self._event_cache: OrderedDict[str, list[StepDict]] = OrderedDict()
+        # Single long-lived connection, opened lazily on first query
+        self._db: Optional[aiosqlite.Connection] = None
+        self._db_lock = asyncio.Lock()
+        # Converted thread steps keyed by thread id, tagged with the latest event timestamp they were built from
+        # (update_time only moves on state changes, so it misses events without a state delta)
+        self._thread_steps_cache: OrderedDict[str, tuple[Any, list[StepDict]]] = OrderedDict()
 
         # Register cleanup handlers for application termination
         atexit.register(self._sync_cleanup)
@@ -61,27 +116,35 @@ class GoogleADKDataLayer(BaseDataLayer):
     async def get_current_timestamp(self) -> datetime:
         return datetime.now()
 
+    async def _get_db(self) -> aiosqlite.Connection:
+        if self._db is None:
+            async with self._db_lock:
+                if self._db is None:
+                    db = await aiosqlite.connect(self.database_url, uri=True, cached_statements=SQLITE_CACHED_STATEMENTS)
+                    db.row_factory = aiosqlite.Row
+                    await db.executescript(SQLITE_PRAGMAS)
+                    try:
+                        await db.executescript(INDEX_MIGRATION)
+                    except aiosqlite.Error as e:
+                        # Tables are created by the session service on first use; indexes follow on next start
+                        await db.rollback()
+                        logger.warning(f"Skipped index migration: {e!s}")
+                    self._db = db
+        return self._db
+
     async def execute_query(
         self, query: str, params: Union[Dict, None] = None
     ) -> List[Dict[str, Any]]:
-        async with aiosqlite.connect(self.database_url) as db:
-            db.row_factory = aiosqlite.Row
-            try:
-                async with db.execute(query, list(params.values()) if params else []) as cursor:
-                    records = await cursor.fetchall()
-                    return [dict(record) for record in records]
-            except Exception as e:
-                logger.error(f"Database error: {e!s}")
-                raise
+        db = await self._get_db()
+        try:
+            async with db.execute(query, list(params.values()) if params else []) as cursor:
+                return [dict(record) async for record in cursor]
+        except Exception as e:
+            logger.error(f"Database error: {e!s}")
+            raise
 
     async def get_user(self, identifier: str) -> Optional[PersistedUser]:
-        query = """
-        SELECT user_id, MIN(create_time) as created_at 
-        FROM sessions 
-        WHERE user_id = ?
-        GROUP BY user_id
-        """
-        result = await self.execute_query(query, {"identifier": identifier})
+        result = await self.execute_query(_Q_GET_USER, {"identifier": identifier})
         if not result or len(result) == 0:
             return None
         row = result[0]
@@ -142,12 +205,7 @@ class GoogleADKDataLayer(BaseDataLayer):
         pass
 
     async def get_thread_author(self, thread_id: str) -> str:
-        query = """
-        SELECT user_id 
-        FROM sessions
-        WHERE id = ?
-        """
-        results = await self.execute_query(query, {"thread_id": thread_id})
+        results = await self.execute_query(_Q_GET_THREAD_AUTHOR, {"thread_id": thread_id})
         if not results:
             raise ValueError(f"Thread {thread_id} not found")
         return results[0]["user_id"]
@@ -160,43 +218,49 @@ class GoogleADKDataLayer(BaseDataLayer):
             user_id=author, # need to fetch
             session_id=thread_id
         )
+        self._thread_steps_cache.pop(thread_id, None)
+
+    async def _get_thread_steps(
+        self, thread_id: str, user_id: str, last_event_at: Any
+    ) -> list[StepDict]:
+        """Converted steps for a thread, reloading the ADK session only when it has new events since the last load."""
+        cached = self._thread_steps_cache.get(thread_id)
+        if cached and cached[0] == last_event_at:
+            self._thread_steps_cache.move_to_end(thread_id)
+            return cached[1]
+        session = await session_service.get_session(
+            app_name=APP_NAME,
+            user_id=user_id,
+            session_id=thread_id
+        )
+        if not session:
+            raise ValueError(f"Session for thread {thread_id} not found")
+
+        steps, _ = self._convert_events_to_chainlit(session)
+        self._thread_steps_cache[thread_id] = (last_event_at, steps)
+        self._thread_steps_cache.move_to_end(thread_id)
+        if len(self._thread_steps_cache) > THREAD_STEPS_CACHE_SIZE:
+            self._thread_steps_cache.popitem(last=False)
+        return steps
 
     async def list_threads(
         self, pagination: Pagination, filters: ThreadFilter
     ) -> PaginatedResponse[ThreadDict]:
-        query = """
-        SELECT 
-            s.id,
-            s.create_time as "createdAt",
-            s.id as name,
-            s.user_id as "userId",
-            s.user_id as user_identifier,
-            s.state as metadata
-        FROM sessions s
-        WHERE 1=1
-        """
-        params: Dict[str, Any] = {}
-        param_count = 1
-
-        if filters.search:
-            query += f" AND s.id ILIKE ?"
-            params[f"param_{param_count}"] = f"%{filters.search}%"
-            param_count += 1
-
-        if filters.userId:
-            query += f' AND s.user_id = ?'
-            params[f"param_{param_count}"] = filters.userId
-            param_count += 1
-
-        if pagination.cursor:
-            query += f' AND s.create_time < (SELECT create_time FROM sessions WHERE id = ?)'
-            params[f"param_{param_count}"] = pagination.cursor
-            param_count += 1
-
-        query += f' ORDER BY s.create_time DESC LIMIT ?'
-        params[f"param_{param_count}"] = pagination.first + 1
-
-        results = await self.execute_query(query, params)
+        search = f"%{filters.search}%" if filters.search else None
+        user_id = filters.userId or None
+        cursor = pagination.cursor or None
+        # Every filter is always bound (None = inactive) so the SQL text never changes
+        params: Dict[str, Any] = {
+            "search": search,
+            "search_pattern": search,
+            "user_id": user_id,
+            "user_id_match": user_id,
+            "cursor": cursor,
+            "cursor_id": cursor,
+            "limit": pagination.first + 1,
+        }
+
+        results = await self.execute_query(_Q_LIST_THREADS, params)
         threads = results
 
         has_next_page = len(threads) > pagination.first
@@ -205,13 +269,14 @@ class GoogleADKDataLayer(BaseDataLayer):
 
         thread_dicts = []
         for thread in threads:
+            # The sidebar only needs thread headers; steps are loaded (and cached) when a thread is opened
             thread_dict = ThreadDict(
                 id=str(thread["id"]),
                 createdAt=thread["createdAt"],
                 name=thread["name"],
                 userId=str(thread["userId"]) if thread["userId"] else None,
                 userIdentifier=thread["user_identifier"],
-                metadata=json.loads(thread["metadata"] or '{}'),
+                metadata=orjson.loads(thread["metadata"]) if thread["metadata"] else {},
                 steps=[],
                 elements=[],
                 tags=[],
@@ -228,12 +293,7 @@ class GoogleADKDataLayer(BaseDataLayer):
         )
 
     async def get_thread(self, thread_id: str) -> Optional[ThreadDict]:
-        query = """
-        SELECT id, create_time as "createdAt", id as name, user_id, state as metadata
-        FROM sessions
-        WHERE id = ?
-        """
-        results = await self.execute_query(query, {"thread_id": thread_id})
+        results = await self.execute_query(_Q_GET_THREAD, {"thread_id": thread_id})
 
         if not results:
             return None
@@ -242,15 +302,7 @@ class GoogleADKDataLayer(BaseDataLayer):
         user_id = thread.get("user_id")
         if not user_id:
             raise ValueError(f"Thread {thread_id} not found or has no user_id")
-        session = await session_service.get_session(
-            app_name=APP_NAME,
-            user_id=user_id,
-            session_id=thread_id
-        )
-        if not session:
-            raise ValueError(f"Session for thread {thread_id} not found")
-
-        steps, elements = self._convert_events_to_chainlit(session)
+        steps = await self._get_thread_steps(thread_id, user_id, thread["lastEventAt"])
         return ThreadDict(
             id=str(thread["id"]),
             createdAt=thread["createdAt"],
@@ -259,7 +311,7 @@ class GoogleADKDataLayer(BaseDataLayer):
             userIdentifier=str(thread["user_id"]) if thread["user_id"] else None,
             metadata={},
             steps=steps,
-            elements=elements,
+            elements=[],
             tags=[],
         )
 
@@ -277,65 +329,74 @@ class GoogleADKDataLayer(BaseDataLayer):
     def _extract_feedback_dict_from_step_row(self, row: Dict) -> Optional[FeedbackDict]:
         return None
 
-    def _convert_event_to_chainlit(self, session_id, event: Event) -> tuple[list[StepDict], list[ElementDict]]:
+    def _convert_event_to_chainlit(self, session_id, event: Event) -> list[StepDict]:
+        cached = self._event_cache.get(event.id)
+        if cached is not None:
+            self._event_cache.move_to_end(event.id)
+            return cached
+        converted = self._build_chainlit_steps(session_id, event)
+        self._event_cache[event.id] = converted
+        if len(self._event_cache) > EVENT_CACHE_SIZE:
+            self._event_cache.popitem(last=False)
+        return converted
+
+    def _build_chainlit_steps(self, session_id, event: Event) -> list[StepDict]:
         steps = []
-        elements = []
         function_call_steps = {}
-        print("\n\n")
-        print(event)
-        print("\n\n")
-        event_text = ""
-        pId = 0
+        if self.show_logger:
+            logger.debug("event=%r", event)
+        text_parts: list[str] = []
+        # Per-event values shared by every step built below
+        ev_id = event.id
+        metadata = event.custom_metadata or {}
+        ts = str(event.timestamp)
 
         if event.error_code:
             steps.append(StepDict(
-                id=event.id,
+                id=ev_id,
                 threadId=session_id,
                 parentId=None,  # Not available in ADK
                 name=event.author,
                 type="system_message",
                 input="",
                 output=f"`{event.error_code}`]`: {event.error_message}",
-                metadata=event.custom_metadata or {},
-                createdAt=str(event.timestamp),
+                metadata=metadata,
+                createdAt=ts,
                 showInput=False,
                 isError=True,
                 feedback=None,
             ))
-            return steps, elements
-        if not event.content:
-            return steps, elements
-        if not event.content.parts:
-            return steps, elements
+            return steps
+        if not (event.content and event.content.parts):
+            return steps
         if not event.actions.state_delta:
             steps.append(StepDict(
-                id=event.id + "_stupd",
+                id=ev_id + "_stupd",
                 threadId=session_id,
-                parentId=event.id,
+                parentId=ev_id,
                 name=event.author,
                 type="system_message",
                 input="",
                 output="*State updated.*",
-                metadata=event.custom_metadata or {},
-                createdAt=str(event.timestamp),
+                metadata=metadata,
+                createdAt=ts,
                 showInput=False,
                 isError=False,
                 feedback=None,
             ))
-        for part in event.content.parts:
-            pId += 1
-            part_id = f"{event.id}_{pId}"
+        for pId, part in enumerate(event.content.parts, 1):
+            part_id = f"{ev_id}_{pId}"
             if part.function_call:
                 call_step = StepDict(
                     id=part_id,
                     threadId=session_id,
-                    parentId=event.id,
+                    parentId=ev_id,
                     name=part.function_call.name or "(unknown)",
                     type="tool",
                     input=str(part.function_call.args),
                     output="(ERROR)",
-                    metadata=event.custom_metadata or {},
-                    createdAt=str(event.timestamp),
+                    metadata=metadata,
+                    createdAt=ts,
                     showInput=True,
                     isError=False,
                     feedback=None,
@@ -357,32 +418,32 @@ class GoogleADKDataLayer(BaseDataLayer):
                     #         text=part.function_response.error,
                     #     )
             if part.text:
-                event_text += part.text
+                text_parts.append(part.text)
+        event_text = "".join(text_parts)
         if event_text:
+            role_type = "user_message" if event.content.role == "user" else "assistant_message"
             steps.append(StepDict(
-                    id=event.id,
+                    id=ev_id,
                     threadId=session_id,
                     parentId=None,  # Not available in ADK
                     name=event.author,
-                    type="user_message" if event.content.role == "user" else "assistant_message",
+                    type=role_type,
                     input="",
                     output=event_text,
-                    metadata=event.custom_metadata or {},
-                    createdAt=str(event.timestamp),
+                    metadata=metadata,
+                    createdAt=ts,
                     showInput=False,
                     isError=False,
                     feedback=None,
                 ))
-        return steps, elements
+        return steps
 
     def _convert_events_to_chainlit(self, session: Session) -> tuple[list[StepDict], list[ElementDict]]:
         steps = []
-        elements = []
         for event in session.events:
-            event_steps, event_elements = self._convert_event_to_chainlit(session.id, event)
-            steps.extend(event_steps)
-            elements.extend(event_elements)
-        return steps, elements
+            steps.extend(self._convert_event_to_chainlit(session.id, event))
+        # Elements are not stored by ADK; reintroduce them here if they ever are
+        return steps, []
 
     def _convert_element_row_to_dict(self, row: Dict) -> ElementDict:
         # Not implemented as ADK schema does not map directly to elements
@@ -393,7 +454,9 @@ class GoogleADKDataLayer(BaseDataLayer):
 
     async def cleanup(self):
         """Cleanup database connections"""
-        pass
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
 
     def _sync_cleanup(self):
         """Cleanup database connections in a synchronous context."""